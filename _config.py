@@ -0,0 +1,255 @@
+"""pi-key: config.yaml parsing shared by boot.py and code.py
+
+boot.py needs the button type and USB identity, code.py the timing,
+color and LED settings; both read them through parse_config() so the
+two entry points can never disagree about the file format.
+"""
+import os
+import json
+from _usb_presets import USB_PRESET_NAMES, USB_PRESET_ROWS
+
+CONFIG_FILE = "config.yaml"  # Configuration file
+CACHE_FILE = "config.json"  # Parsed config, regenerated when config.yaml changes
+CACHE_VERSION = 2  # Bump when the cached format or color order changes
+COLOR_KEYS = ("macro_color", "keepalive_color", "cancel_color")  # Stored as lists in JSON
+
+# --- Default Values ---
+# These are used if config file is missing or invalid
+DEFAULT_BUTTON_TYPE = "mechanical"  # mechanical (active-low) or capacitive (active-high)
+DEFAULT_DOUBLE_PRESS_GAP = 0.5  # Max time between clicks for double-press
+DEFAULT_LONG_PRESS_DURATION = 1.0  # Hold duration to trigger keep-alive
+DEFAULT_KEEP_ALIVE_MIN = 0.8  # Minimum interval between keep-alive keystrokes
+DEFAULT_KEEP_ALIVE_MAX = 2.0  # Maximum interval between keep-alive keystrokes
+DEFAULT_MACRO_COLOR = (128, 0, 128)  # Purple
+DEFAULT_KEEPALIVE_COLOR = (255, 191, 0)  # Amber
+DEFAULT_CANCEL_COLOR = (255, 0, 0)  # Red
+DEFAULT_LED_ENABLED = True  # Set False for builds without the status LED
+DEFAULT_USB_PRESET = "dell_kb216"  # USB identity used in stealth mode
+
+# --- Named Colors (RGB; code.py's NeoPixel handles the wire byte order) ---
+NAMED_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "cyan": (0, 255, 255),
+    "magenta": (255, 0, 255),
+    "white": (255, 255, 255),
+    "purple": (128, 0, 128),
+    "amber": (255, 191, 0),
+    "orange": (255, 128, 0),
+}
+
+def parse_hex_color(hex_str):
+    """Convert hex color code to RGB tuple.
+    
+    Args:
+        hex_str: Hex color string (e.g., "#FF00FF" or "FF00FF")
+    
+    Returns:
+        Tuple (R, G, B)
+    """
+    # Remove # prefix if present
+    hex_str = hex_str.strip().lstrip("#")
+    
+    # Parse RGB values
+    if len(hex_str) == 6:
+        r = int(hex_str[0:2], 16)
+        g = int(hex_str[2:4], 16)
+        b = int(hex_str[4:6], 16)
+        return (r, g, b)
+    else:
+        raise ValueError("Invalid hex color format. Expected 6-character hex string (e.g., FF00FF or #FF00FF)")
+
+def parse_color(color_str):
+    """Parse color string (hex or named color) to RGB tuple.
+    
+    Args:
+        color_str: Color string (e.g., "#FF00FF", "purple", "red")
+    
+    Returns:
+        Tuple (R, G, B)
+    """
+    color_str = color_str.strip().lower()
+    
+    # Check if it's a named color (one lookup)
+    color = NAMED_COLORS.get(color_str)
+    if color is not None:
+        return color
+    
+    # Try to parse as hex
+    try:
+        return parse_hex_color(color_str)
+    except ValueError:
+        # Return default purple if parsing fails
+        return DEFAULT_MACRO_COLOR
+
+def parse_config():
+    """Parse config.yaml and return configuration settings.
+    
+    Returns dict with button type, USB identity (manufacturer, product,
+    vid, pid), timing constants, color settings and LED flag.
+    Falls back to defaults (and the dell_kb216 preset) if config
+    missing or invalid.
+    """
+    config = {
+        "button_type": DEFAULT_BUTTON_TYPE,
+        "double_press_gap": DEFAULT_DOUBLE_PRESS_GAP,
+        "long_press_duration": DEFAULT_LONG_PRESS_DURATION,
+        "keep_alive_min": DEFAULT_KEEP_ALIVE_MIN,
+        "keep_alive_max": DEFAULT_KEEP_ALIVE_MAX,
+        "macro_color": DEFAULT_MACRO_COLOR,
+        "keepalive_color": DEFAULT_KEEPALIVE_COLOR,
+        "cancel_color": DEFAULT_CANCEL_COLOR,
+        "led_enabled": DEFAULT_LED_ENABLED,
+        "usb_preset": DEFAULT_USB_PRESET,
+        "usb_manufacturer": None,
+        "usb_product": None,
+        "usb_vid": None,
+        "usb_pid": None,
+    }
+    
+    try:
+        # Read in one call so the file is closed before parsing starts
+        with open(CONFIG_FILE, "r") as f:
+            raw = f.read()
+        for line in raw.splitlines():
+            # Strip whitespace and skip comments/empty lines
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            
+            # Parse key: value pairs
+            if ":" in line:
+                key, value = line.split(":", 1)
+                key = key.strip()
+                value = value.strip()
+                
+                # Remove trailing comments
+                if "#" in value:
+                    value = value.split("#")[0].strip()
+                
+                # Parse button type
+                if key == "button_type":
+                    if value.lower() in ["mechanical", "capacitive"]:
+                        config["button_type"] = value.lower()
+                # Parse timing values
+                elif key == "double_press_gap":
+                    config["double_press_gap"] = float(value)
+                elif key == "long_press_duration":
+                    config["long_press_duration"] = float(value)
+                elif key == "keep_alive_min":
+                    config["keep_alive_min"] = float(value)
+                elif key == "keep_alive_max":
+                    config["keep_alive_max"] = float(value)
+                # Parse color values
+                elif key == "macro_color":
+                    config["macro_color"] = parse_color(value)
+                elif key == "keepalive_color":
+                    config["keepalive_color"] = parse_color(value)
+                elif key == "cancel_color":
+                    config["cancel_color"] = parse_color(value)
+                # Parse LED enable flag
+                elif key == "led_enabled":
+                    if value.lower() in ["true", "false"]:
+                        config["led_enabled"] = value.lower() == "true"
+                # Store USB identity values (resolved below)
+                elif key in config:
+                    config[key] = value
+    except Exception as e:
+        print(f"Config error (using defaults): {e}")
+    
+    # Determine USB settings
+    preset_name = config["usb_preset"]
+    if preset_name == "custom":
+        # Use custom values
+        config["manufacturer"] = config["usb_manufacturer"] or "Generic"
+        config["product"] = config["usb_product"] or "USB Keyboard"
+        config["vid"] = int(config["usb_vid"] or "0x1234", 16)
+        config["pid"] = int(config["usb_pid"] or "0x5678", 16)
+    else:
+        # Use preset (default to dell_kb216 if invalid)
+        try:
+            idx = USB_PRESET_NAMES.index(preset_name)
+        except ValueError:
+            idx = 0
+        (config["manufacturer"], config["product"],
+         config["vid"], config["pid"]) = USB_PRESET_ROWS[idx]
+    
+    return config
+
+
+def config_stat():
+    """Return (mtime, size) of config.yaml, or None if missing."""
+    try:
+        st = os.stat(CONFIG_FILE)
+        return (st[8], st[6])
+    except OSError:
+        return None
+
+
+def load_config(stat):
+    """Return (config, from_cache), skipping the YAML parse when possible.
+    
+    Uses config.json if it was written by this cache version for a
+    config.yaml with the same modification time and size, otherwise
+    falls back to parse_config().
+    
+    Args:
+        stat: (mtime, size) from config_stat()
+    """
+    try:
+        with open(CACHE_FILE, "r") as f:
+            cache = json.load(f)
+        if (stat is not None and cache.get("version") == CACHE_VERSION and
+                cache["mtime"] == stat[0] and cache["size"] == stat[1]):
+            config = cache["cfg"]
+            # JSON has no tuples; restore the color tuples the LED code expects
+            for key in COLOR_KEYS:
+                config[key] = tuple(config[key])
+            return config, True
+    except Exception:
+        pass  # Missing, stale or corrupt cache, reparse below
+    return parse_config(), False
+
+
+def write_config_cache(config, stat):
+    """Write parsed config to config.json for the next boot.
+    
+    Only succeeds when the filesystem is writable by CircuitPython
+    (i.e. the USB drive is disabled); errors are ignored.
+    
+    Args:
+        config: Dict returned by parse_config()
+        stat: (mtime, size) from config_stat()
+    """
+    if stat is None:
+        return  # Defaults only, nothing to key the cache on
+    try:
+        with open(CACHE_FILE, "w") as f:
+            json.dump({"version": CACHE_VERSION, "mtime": stat[0],
+                       "size": stat[1], "cfg": config}, f)
+    except OSError as e:
+        print(f"Config cache not written: {e}")
+
+
+def read_button(button, button_type):
+    """Read button state with logic inversion for capacitive sensors.
+    
+    Args:
+        button: DigitalInOut button object
+        button_type: "mechanical" or "capacitive"
+    
+    Returns:
+        bool: True if button is released, False if pressed
+              (normalized to active-low logic regardless of sensor type)
+    """
+    raw_value = button.value
+    if button_type == "capacitive":
+        # Capacitive sensors in AB=00 mode output HIGH when touched
+        # Invert so pressed=False (active-low, like mechanical)
+        return not raw_value
+    else:
+        # Mechanical switches are active-low by default
+        # Released=HIGH (True), Pressed=LOW (False)
+        return raw_value
@@ -0,0 +1,80 @@
+"""pi-key: Macro key name tables for code.py
+
+Only code.py imports this module, so boot.py never loads Keycode.
+Precompiled with mpy-cross by deploy.sh; the tables are still built in
+RAM when code.py imports it.
+"""
+from adafruit_hid.keycode import Keycode
+
+# --- Special Key Mapping ---
+# (name, keycode) pairs for {KEY} patterns. These are only walked once to
+# build MACRO_TOKENS below, so they are tuples rather than dicts (no hash
+# table kept in RAM).
+SPECIAL_KEYS = (
+    ("ENTER", Keycode.ENTER),
+    ("TAB", Keycode.TAB),
+    ("SPACE", Keycode.SPACE),
+    ("BACKSPACE", Keycode.BACKSPACE),
+    ("DELETE", Keycode.DELETE),
+    ("ESC", Keycode.ESCAPE),
+    ("UP", Keycode.UP_ARROW),
+    ("DOWN", Keycode.DOWN_ARROW),
+    ("LEFT", Keycode.LEFT_ARROW),
+    ("RIGHT", Keycode.RIGHT_ARROW),
+    ("HOME", Keycode.HOME),
+    ("END", Keycode.END),
+    ("PAGEUP", Keycode.PAGE_UP),
+    ("PAGEDOWN", Keycode.PAGE_DOWN),
+    ("F1", Keycode.F1),
+    ("F2", Keycode.F2),
+    ("F3", Keycode.F3),
+    ("F4", Keycode.F4),
+    ("F5", Keycode.F5),
+    ("F6", Keycode.F6),
+    ("F7", Keycode.F7),
+    ("F8", Keycode.F8),
+    ("F9", Keycode.F9),
+    ("F10", Keycode.F10),
+    ("F11", Keycode.F11),
+    ("F12", Keycode.F12),
+    ("F13", Keycode.F13),
+    ("F14", Keycode.F14),
+    ("F15", Keycode.F15),
+)
+
+# (name, keycode) pairs for modifier names
+MODIFIERS = (
+    ("CTRL", Keycode.CONTROL),
+    ("SHIFT", Keycode.SHIFT),
+    ("ALT", Keycode.ALT),
+    ("GUI", Keycode.GUI),  # Windows/Super/Command key
+    ("WIN", Keycode.GUI),
+    ("CMD", Keycode.GUI),
+)
+
+# (name, keycode) pairs for digits (Keycode spells them out: ZERO, ONE, ...)
+DIGIT_KEYS = (
+    ("0", Keycode.ZERO),
+    ("1", Keycode.ONE),
+    ("2", Keycode.TWO),
+    ("3", Keycode.THREE),
+    ("4", Keycode.FOUR),
+    ("5", Keycode.FIVE),
+    ("6", Keycode.SIX),
+    ("7", Keycode.SEVEN),
+    ("8", Keycode.EIGHT),
+    ("9", Keycode.NINE),
+)
+
+# Single lookup for macro tokens: name -> (is_modifier, keycode)
+# Includes single letters and digits so {CTRL+C} or {ALT+1} resolve
+# without getattr(Keycode, ...)
+MACRO_TOKENS = {}
+for _name, _code in SPECIAL_KEYS:
+    MACRO_TOKENS[_name] = (False, _code)
+for _name in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+    MACRO_TOKENS[_name] = (False, getattr(Keycode, _name))
+for _name, _code in DIGIT_KEYS:
+    MACRO_TOKENS[_name] = (False, _code)
+for _name, _code in MODIFIERS:
+    MACRO_TOKENS[_name] = (True, _code)
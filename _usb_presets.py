@@ -0,0 +1,30 @@
+"""pi-key: USB identity presets, read at boot
+
+Kept free of imports so resolving the USB identity in boot.py does not
+load adafruit_hid. Precompiled with mpy-cross by deploy.sh.
+"""
+
+# === USB Device Presets ===
+# Preset names, indexed in parallel with USB_PRESET_ROWS (first is the default)
+USB_PRESET_NAMES = (
+    "dell_kb216",
+    "logitech_k120",
+    "hp_km100",
+    "microsoft_600",
+    "apple_keyboard",
+    "firmware",
+)
+
+# (manufacturer, product, vid, pid) for each preset
+USB_PRESET_ROWS = (
+    ("Dell Computer Corp.", "KB216 Wired Keyboard", 0x413C, 0x2113),
+    ("Logitech", "USB Keyboard", 0x046D, 0xC31C),
+    ("Chicony Electronics Co., Ltd.", "HP USB Keyboard", 0x03F0, 0x0024),
+    ("Microsoft", "Wired Keyboard 600", 0x045E, 0x0750),
+    ("Apple Inc.", "Apple Keyboard", 0x05AC, 0x0250),
+    ("Waveshare Electronics", "RP2040-One", 0x2E8A, 0x103A),
+)
+
+# Identity the CircuitPython firmware already reports for this board;
+# boot.py skips set_usb_identification() when the config resolves to it
+FIRMWARE_USB_ID = USB_PRESET_ROWS[-1]
@@ -7,153 +7,79 @@ Features:
 - Visual feedback via WS2812 RGB LED
 - Fully configurable via config.yaml (timing, colors, USB identity)
 """
+import gc
 import time
+import supervisor
+from micropython import const
 import board
-import digitalio
+import keypad
 import usb_hid
-import neopixel
-import random
 from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keycode import Keycode
 from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+from adafruit_hid.keycode import Keycode
+from _keys import MACRO_TOKENS
+from _config import config_stat, load_config
 
 # --- Hardware Configuration ---
-BUTTON_PIN = board.GP29  # Momentary button (internal pull-up, active-low)
-NEOPIXEL_PIN = board.GP16  # WS2812 RGB LED (GRB color order)
+BUTTON_PIN = board.GP29  # Momentary button (internal pull-up; active-low unless capacitive)
+BUTTON_SCAN_INTERVAL = 0.005  # keypad scan period (seconds); presses register on the first scan
+RELEASE_DEBOUNCE_MS = const(10)  # Two scans: a bounce re-press lands one scan after the release
+NEOPIXEL_PIN = board.GP16  # WS2812 RGB LED (colors are RGB tuples)
 MACRO_FILE = "macro.txt"  # Text file containing string to type
 KEEPALIVE_FILE = "keepalive.txt"  # Text file containing keep-alive sequence
-CONFIG_FILE = "config.yaml"  # Configuration file
-
-# --- Default Values ---
-# These are used if config file is missing or invalid
-DEFAULT_BUTTON_TYPE = "mechanical"  # mechanical (active-low) or capacitive (active-high)
-DEFAULT_DOUBLE_PRESS_GAP = 0.5  # Max time between clicks for double-press
-DEFAULT_LONG_PRESS_DURATION = 1.0  # Hold duration to trigger keep-alive
-DEFAULT_KEEP_ALIVE_MIN = 0.8  # Minimum interval between keep-alive keystrokes
-DEFAULT_KEEP_ALIVE_MAX = 2.0  # Maximum interval between keep-alive keystrokes
-DEFAULT_MACRO_COLOR = (0, 128, 128)  # Purple in GRB
-DEFAULT_KEEPALIVE_COLOR = (191, 255, 0)  # Amber in GRB
-DEFAULT_CANCEL_COLOR = (0, 255, 0)  # Red in GRB
-
-# --- Named Colors (in GRB format for WS2812) ---
-NAMED_COLORS = {
-    "red": (0, 255, 0),
-    "green": (255, 0, 0),
-    "blue": (0, 0, 255),
-    "yellow": (255, 255, 0),
-    "cyan": (255, 0, 255),
-    "magenta": (0, 255, 255),
-    "white": (255, 255, 255),
-    "purple": (0, 128, 128),
-    "amber": (191, 255, 0),
-    "orange": (128, 255, 0),
-}
-
-def parse_hex_color(hex_str):
-    """Convert hex color code to GRB tuple for WS2812.
+
+# --- Diagnostics ---
+# Set to 1 to print button events on the serial console. const(0) lets the
+# compiler drop the prints (and their string formatting) from the loop.
+DEBUG = const(0)
+
+# --- Polling Rates ---
+POLL_FAST = 0.01  # Loop period while active (100Hz, smooth LED animation)
+POLL_IDLE = 0.05  # Loop period once idle (20Hz, fewer wakeups)
+POLL_IDLE_AFTER_MS = const(1000)  # Idle time (ms) without button activity before slowing down
+
+def scale_color(color, factor):
+    """Scale an RGB color tuple by a brightness factor (0.0-1.0).
     
     Args:
-        hex_str: Hex color string (e.g., "#FF00FF" or "FF00FF")
+        color: Tuple (R, G, B)
+        factor: Brightness multiplier
     
     Returns:
-        Tuple (G, R, B) for WS2812 LED
+        Tuple (R, G, B) with each channel scaled and truncated to int
     """
-    # Remove # prefix if present
-    hex_str = hex_str.strip().lstrip("#")
-    
-    # Parse RGB values
-    if len(hex_str) == 6:
-        r = int(hex_str[0:2], 16)
-        g = int(hex_str[2:4], 16)
-        b = int(hex_str[4:6], 16)
-        return (g, r, b)  # Convert RGB to GRB
-    else:
-        raise ValueError("Invalid hex color format. Expected 6-character hex string (e.g., FF00FF or #FF00FF)")
+    return (int(color[0] * factor),
+            int(color[1] * factor),
+            int(color[2] * factor))
 
-def parse_color(color_str):
-    """Parse color string (hex or named color) to GRB tuple.
+def color_table(color, factors):
+    """Build a tuple of scaled colors, one per brightness factor.
+    
+    Neighbouring entries that scale to the same color share one tuple
+    object, and entries that scale to black are LED_OFF itself, so
+    set_pixel() can skip them with an identity check (including moving
+    between tables while the LED is off).
     
     Args:
-        color_str: Color string (e.g., "#FF00FF", "purple", "red")
+        color: Tuple (R, G, B)
+        factors: Iterable of brightness multipliers
     
     Returns:
-        Tuple (G, R, B) for WS2812 LED
+        Tuple of (R, G, B) tuples
     """
-    color_str = color_str.strip().lower()
-    
-    # Check if it's a named color
-    if color_str in NAMED_COLORS:
-        return NAMED_COLORS[color_str]
-    
-    # Try to parse as hex
-    try:
-        return parse_hex_color(color_str)
-    except ValueError:
-        # Return default purple if parsing fails
-        return DEFAULT_MACRO_COLOR
-
-def parse_config():
-    """Parse config.yaml and return configuration settings.
-    
-    Returns dict with timing constants and color settings.
-    Falls back to defaults if config missing or invalid.
-    """
-    config = {
-        "button_type": DEFAULT_BUTTON_TYPE,
-        "double_press_gap": DEFAULT_DOUBLE_PRESS_GAP,
-        "long_press_duration": DEFAULT_LONG_PRESS_DURATION,
-        "keep_alive_min": DEFAULT_KEEP_ALIVE_MIN,
-        "keep_alive_max": DEFAULT_KEEP_ALIVE_MAX,
-        "macro_color": DEFAULT_MACRO_COLOR,
-        "keepalive_color": DEFAULT_KEEPALIVE_COLOR,
-        "cancel_color": DEFAULT_CANCEL_COLOR,
-    }
-    
-    try:
-        with open(CONFIG_FILE, "r") as f:
-            for line in f:
-                # Strip whitespace and skip comments/empty lines
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                
-                # Parse key: value pairs
-                if ":" in line:
-                    key, value = line.split(":", 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Remove trailing comments
-                    if "#" in value:
-                        value = value.split("#")[0].strip()
-                    
-                    # Parse button type
-                    if key == "button_type":
-                        if value.lower() in ["mechanical", "capacitive"]:
-                            config["button_type"] = value.lower()
-                    # Parse timing values
-                    elif key == "double_press_gap":
-                        config["double_press_gap"] = float(value)
-                    elif key == "long_press_duration":
-                        config["long_press_duration"] = float(value)
-                    elif key == "keep_alive_min":
-                        config["keep_alive_min"] = float(value)
-                    elif key == "keep_alive_max":
-                        config["keep_alive_max"] = float(value)
-                    # Parse color values
-                    elif key == "macro_color":
-                        config["macro_color"] = parse_color(value)
-                    elif key == "keepalive_color":
-                        config["keepalive_color"] = parse_color(value)
-                    elif key == "cancel_color":
-                        config["cancel_color"] = parse_color(value)
-    except Exception as e:
-        print(f"Config error (using defaults): {e}")
-    
-    return config
+    table = []
+    for factor in factors:
+        scaled = scale_color(color, factor)
+        if scaled == LED_OFF:
+            scaled = LED_OFF
+        elif table and table[-1] == scaled:
+            scaled = table[-1]
+        table.append(scaled)
+    return tuple(table)
 
 # --- Load Configuration ---
-config = parse_config()
+# Reuses boot.py's config.json cache when config.yaml is unchanged
+config, config_cached = load_config(config_stat())
 BUTTON_TYPE = config["button_type"]
 DOUBLE_PRESS_GAP = config["double_press_gap"]
 LONG_PRESS_DURATION = config["long_press_duration"]
@@ -162,8 +88,15 @@ KEEP_ALIVE_MAX = config["keep_alive_max"]
 MACRO_COLOR = config["macro_color"]
 KEEPALIVE_COLOR = config["keepalive_color"]
 CANCEL_COLOR = config["cancel_color"]
+LED_ENABLED = config["led_enabled"]
 
-print(f"Config loaded: button={BUTTON_TYPE}, gap={DOUBLE_PRESS_GAP}s, long={LONG_PRESS_DURATION}s, "
+# Integer milliseconds for the main loop, which runs on supervisor.ticks_ms()
+DOUBLE_PRESS_GAP_MS = int(DOUBLE_PRESS_GAP * 1000)
+LONG_PRESS_MS = int(LONG_PRESS_DURATION * 1000)
+KEEP_ALIVE_MIN_MS = int(KEEP_ALIVE_MIN * 1000)
+KEEP_ALIVE_MAX_MS = int(KEEP_ALIVE_MAX * 1000)
+
+print(f"Config loaded{' (cached)' if config_cached else ''}: button={BUTTON_TYPE}, gap={DOUBLE_PRESS_GAP}s, long={LONG_PRESS_DURATION}s, "
       f"keepalive={KEEP_ALIVE_MIN}-{KEEP_ALIVE_MAX}s")
 
 # --- Load Macro String from File ---
@@ -184,104 +117,210 @@ except Exception as e:
     print(f"Error loading {KEEPALIVE_FILE} (using default): {e}")
     KEEPALIVE_STRING = "{SPACE}{LEFT_ARROW}"
 
-# --- Special Key Mapping ---
-# Maps {KEY} patterns to Keycode constants
-SPECIAL_KEYS = {
-    "ENTER": Keycode.ENTER,
-    "TAB": Keycode.TAB,
-    "SPACE": Keycode.SPACE,
-    "BACKSPACE": Keycode.BACKSPACE,
-    "DELETE": Keycode.DELETE,
-    "ESC": Keycode.ESCAPE,
-    "UP": Keycode.UP_ARROW,
-    "DOWN": Keycode.DOWN_ARROW,
-    "LEFT": Keycode.LEFT_ARROW,
-    "RIGHT": Keycode.RIGHT_ARROW,
-    "HOME": Keycode.HOME,
-    "END": Keycode.END,
-    "PAGEUP": Keycode.PAGE_UP,
-    "PAGEDOWN": Keycode.PAGE_DOWN,
-    "F1": Keycode.F1,
-    "F2": Keycode.F2,
-    "F3": Keycode.F3,
-    "F4": Keycode.F4,
-    "F5": Keycode.F5,
-    "F6": Keycode.F6,
-    "F7": Keycode.F7,
-    "F8": Keycode.F8,
-    "F9": Keycode.F9,
-    "F10": Keycode.F10,
-    "F11": Keycode.F11,
-    "F12": Keycode.F12,
-    "F13": Keycode.F13,
-    "F14": Keycode.F14,
-    "F15": Keycode.F15,
-}
-
-# Maps modifier names to Keycode constants
-MODIFIERS = {
-    "CTRL": Keycode.CONTROL,
-    "SHIFT": Keycode.SHIFT,
-    "ALT": Keycode.ALT,
-    "GUI": Keycode.GUI,  # Windows/Super/Command key
-    "WIN": Keycode.GUI,
-    "CMD": Keycode.GUI,
-}
-
 # --- Hardware Initialization ---
-# USB HID keyboard
-kbd = Keyboard(usb_hid.devices)
-layout = KeyboardLayoutUS(kbd)
-
-# Button with internal pull-up (True=released, False=pressed)
-btn = digitalio.DigitalInOut(BUTTON_PIN)
-btn.direction = digitalio.Direction.INPUT
-btn.pull = digitalio.Pull.UP
-
-# WS2812 RGB LED (GRB color order on Waveshare RP2040-One)
-pixel = neopixel.NeoPixel(
-    NEOPIXEL_PIN, 1, brightness=1.0,
-    auto_write=False, pixel_order=neopixel.GRB
+# USB HID keyboard, created by start_hid() when first needed: Keyboard()
+# waits for the host to enumerate the device, which would otherwise hold
+# up the button and LED at startup
+kbd = None
+layout = None
+
+# Button scanned by keypad in the background; edges are queued as events
+# (releases are debounced in main()). keypad is always set up active-low so
+# the pin keeps the internal pull-up boot.py also uses (value_when_pressed=True
+# would switch it to a pull-down). Capacitive sensors (AB=00 mode) read HIGH
+# when touched, so main() swaps their press and release edges; an untouched
+# sensor then shows up as one harmless release edge at startup.
+BUTTON_INVERTED = BUTTON_TYPE == "capacitive"
+keys = keypad.Keys(
+    (BUTTON_PIN,), value_when_pressed=False,
+    pull=True, interval=BUTTON_SCAN_INTERVAL
 )
-pixel.fill((0, 0, 0))
-pixel.show()
 
-# --- Button Logic ---
-def read_button():
-    """Read button state with logic inversion for capacitive sensors.
+class NoPixel:
+    """Stand-in for the NeoPixel when led_enabled is false; ignores writes."""
+    
+    def fill(self, color):
+        pass
+    
+    def show(self):
+        pass
+
+# WS2812 RGB LED; the Waveshare RP2040-One's LED takes bytes in RGB order,
+# so pixel_order=RGB sends the color tuples unchanged
+# neopixel is only imported when the LED is enabled, saving RAM otherwise
+if LED_ENABLED:
+    import neopixel
+    pixel = neopixel.NeoPixel(
+        NEOPIXEL_PIN, 1, brightness=1.0,
+        auto_write=False, pixel_order=neopixel.RGB
+    )
+else:
+    pixel = NoPixel()
+
+# --- LED Output ---
+LED_OFF = (0, 0, 0)
+last_pixel_color = None  # Color tuple currently shown on the LED
+
+def set_pixel(color):
+    """Show a color on the LED, skipping the write if it is already shown.
+    
+    Colors come from precomputed tables, so an identity check is enough
+    to detect "no change" and skip the ~30us WS2812 bit-bang. Frames
+    allocate nothing: the tuple already exists and fill() copies it into
+    the native pixel buffer (neopixel exposes no raw buffer to write).
+    
+    Args:
+        color: Tuple (R, G, B)
+    """
+    global last_pixel_color
+    if color is not last_pixel_color:
+        pixel.fill(color)
+        pixel.show()
+        last_pixel_color = color
+
+set_pixel(LED_OFF)
+
+# --- Tick Arithmetic ---
+# supervisor.ticks_ms() returns a small int (no float allocation per call)
+# that wraps every 2**29 ms (~6.2 days); compare ticks only via these helpers
+TICKS_PERIOD = const(1 << 29)
+TICKS_MAX = const(TICKS_PERIOD - 1)
+TICKS_HALFPERIOD = const(TICKS_PERIOD // 2)
+
+
+def ticks_add(ticks, delta):
+    """Return ticks + delta (ms), wrapped like supervisor.ticks_ms()."""
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(end, start):
+    """Return signed end - start in ms, correct across ticks wraparound."""
+    diff = (end - start) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+# --- Keep-Alive Delay Ring ---
+# Pseudo-random delays (ms) from KEEP_ALIVE_MIN_MS to KEEP_ALIVE_MAX_MS, drawn
+# once at startup; keep-alive cycles through them from an offset taken from
+# the long-press time, so each firing is just an index lookup
+KEEP_ALIVE_RING_SIZE = const(32)  # Power of two so the index wraps with &
+KEEP_ALIVE_RING_MASK = const(KEEP_ALIVE_RING_SIZE - 1)
+
+
+def build_delay_ring(count):
+    """Draw pseudo-random keep-alive delays for the delay ring.
+    
+    Uses the ZX81 LCG (x = 75 * (x + 1) % 65537 - 1, values 0-65535),
+    scaled onto the configured keep-alive range.
+    
+    Args:
+        count: Number of delays to draw
     
     Returns:
-        bool: True if button is released, False if pressed
-              (normalized to active-low logic regardless of sensor type)
+        Tuple of delays in milliseconds
     """
-    raw_value = btn.value
-    if BUTTON_TYPE == "capacitive":
-        # Capacitive sensors in AB=00 mode output HIGH when touched
-        # Invert so pressed=False (active-low, like mechanical)
-        return not raw_value
-    else:
-        # Mechanical switches are active-low by default
-        # Released=HIGH (True), Pressed=LOW (False)
-        return raw_value
+    span = KEEP_ALIVE_MAX_MS - KEEP_ALIVE_MIN_MS
+    delays = []
+    x = 1
+    for _ in range(count):
+        x = 75 * (x + 1) % 65537 - 1
+        delays.append(KEEP_ALIVE_MIN_MS + span * x // 65536)
+    return tuple(delays)
 
-# --- Button State Tracking ---
-last_button_state = True  # Button starts released
-press_start_time = 0  # Time when button was pressed
-click_count = 0  # Number of clicks for double-press detection
-last_click_time = 0  # Time of last click
 
-# --- Keep-Alive Mode State ---
-keep_alive_active = False  # Is keep-alive mode active?
-last_keep_alive_time = 0  # Last time we sent a keystroke
-next_keep_alive_delay = 0  # Randomized delay for next keystroke
+KEEP_ALIVE_DELAY_RING = build_delay_ring(KEEP_ALIVE_RING_SIZE)
 
 # --- LED Breathing Animation State ---
-breathe_brightness = 0  # Current brightness (0-127)
-breathe_direction = 1  # 1=brightening, -1=dimming
+# Brightness is 126 - abs(breathe_phase - 126): rises 0->124 in steps of 4 then falls back
+BREATHE_FRAME_MS = const(20)  # Milliseconds per breathing frame (50Hz)
+breathe_phase = 0  # Position in the breathing cycle (0-248, steps of 4)
+breathe_next_tick = 0  # Time the next breathing frame is due (set by start_breathe())
+
+# --- LED Feedback Animation State ---
+# Macro flash and keep-alive exit pulse run as a state machine in the
+# main loop so button polling continues while they play (modes and step
+# counts are const() so they compile to literals)
+FLASH_IDLE = const(0)  # No feedback animation running
+FLASH_RAMP_UP = const(1)  # Macro flash, brightening
+FLASH_RAMP_DOWN = const(2)  # Macro flash, dimming
+FLASH_PULSE = const(3)  # Keep-alive exit pulse
+FLASH_STEPS = const(15)  # Ramp steps in each direction
+FLASH_MAX_BRIGHT = 0.8  # 80% peak brightness for macro flash
+FLASH_GAMMA = 2.2  # Ramp curve, so equal steps look equally bright
+FLASH_FRAME_MS = const(30)  # Milliseconds per ramp frame
+PULSE_COUNT = const(2)  # Number of exit flashes
+PULSE_FRAME_MS = const(150)  # Milliseconds on (and off) per exit flash
+flash_mode = FLASH_IDLE  # Current animation
+flash_step = 0  # Frame within current animation
+flash_next_tick = 0  # Time the next frame is due
+
+# Precomputed macro flash colors for each ramp step (0 to FLASH_STEPS),
+# gamma-corrected: a linear ramp spends most of its frames on levels the
+# eye can't tell apart, so fewer corrected steps look as smooth
+FLASH_TABLE = color_table(MACRO_COLOR, (((i / FLASH_STEPS) ** FLASH_GAMMA) * FLASH_MAX_BRIGHT
+                                        for i in range(FLASH_STEPS + 1)))
+
+# Precomputed keep-alive colors for each brightness level update_breathe()
+# produces (0-124 in steps of 4 = 0-50%); index with brightness >> 2
+BREATHE_TABLE = color_table(KEEPALIVE_COLOR, (b / 255 for b in range(0, 128, 4)))
+
+
+# --- Macro Program Opcodes ---
+# const() integers are inlined by the compiler instead of looked up as globals
+OP_TEXT = const(0)  # (OP_TEXT, text) -> layout.write(text)
+OP_SEND = const(1)  # (OP_SEND, (modifiers..., keycode)) -> kbd.send(*keycodes)
+
+
+def compile_key_seq(token):
+    """Compile a single {...} token into an opcode tuple.
+    
+    Args:
+        token: Token including braces, e.g. "{CTRL+C}" or "{ENTER}"
+    
+    Returns:
+        (OP_SEND, keycodes) with modifiers first, or
+        (OP_TEXT, token) if the token is not a known key
+    """
+    # Extract key sequence
+    key_seq = token[1:-1].upper()
+    modifiers = []
+    key = None
+    
+    # Walk the sequence once, resolving each '+'-separated part as it ends
+    # (one table lookup per part, no split() list)
+    end = len(key_seq)
+    start = 0
+    single = True  # No '+' seen
+    for j in range(end + 1):
+        if j < end and key_seq[j] != '+':
+            continue
+        if j < end:
+            single = False
+        entry = MACRO_TOKENS.get(key_seq[start:j].strip())
+        start = j + 1
+        if entry is None:
+            continue
+        elif entry[0]:
+            modifiers.append(entry[1])
+        else:
+            key = entry[1]
+    
+    if key and modifiers:
+        # Modifier combination
+        modifiers.append(key)
+        return (OP_SEND, tuple(modifiers))
+    elif key:
+        return (OP_SEND, (key,))
+    elif single and modifiers:
+        # Lone modifier like {SHIFT}
+        return (OP_SEND, (modifiers[0],))
+    else:
+        # Unknown key or invalid sequence, type it literally
+        return (OP_TEXT, token)
 
 
-def parse_and_type_macro(macro_string):
-    """Parse macro string and type it, handling special key sequences.
+def compile_macro(macro_string):
+    """Parse macro string once into a list of opcode tuples.
     
     Supports:
     - Plain text: "hello world"
@@ -292,220 +331,412 @@ def parse_and_type_macro(macro_string):
     
     Special keys are wrapped in curly braces: {KEYNAME}
     Modifiers use + to combine: {MOD+KEY}
+    
+    Returns:
+        List of (OP_TEXT, text) and (OP_SEND, keycodes) pairs
+        for type_macro()
     """
+    # Plain text (no keys or escapes) is written in a single call
+    if '{' not in macro_string and '}' not in macro_string:
+        return [(OP_TEXT, macro_string)] if macro_string else []
+    
+    program = []
+    token_ops = {}  # {...} token -> compiled op, so repeats are parsed once
+    text = []  # Pending literal characters, written as one OP_TEXT run
+    last_close = macro_string.rfind('}')  # '{' past this has no closing brace
     i = 0
     while i < len(macro_string):
         # Check for escaped literal braces
         if i < len(macro_string) - 1:
             if macro_string[i:i+2] == '{{':
-                layout.write('{')
+                text.append('{')
                 i += 2
                 continue
             elif macro_string[i:i+2] == '}}':
-                layout.write('}')
+                text.append('}')
                 i += 2
                 continue
         
         # Check for special key sequence
         if macro_string[i] == '{':
-            # Find closing brace
-            close_idx = macro_string.find('}', i)
-            if close_idx == -1:
-                # No closing brace, treat as literal
-                layout.write(macro_string[i])
+            if i > last_close:
+                # No closing brace, treat as literal (without rescanning
+                # the rest of the string for every unclosed '{')
+                text.append(macro_string[i])
                 i += 1
                 continue
             
-            # Extract key sequence
-            key_seq = macro_string[i+1:close_idx].upper()
+            # Find closing brace (only scans the token itself)
+            close_idx = macro_string.find('}', i)
             
-            # Check for modifier+key combination
-            if '+' in key_seq:
-                parts = key_seq.split('+')
-                modifiers = []
-                key = None
-                
-                # Parse modifiers and key
-                for part in parts:
-                    part = part.strip()
-                    if part in MODIFIERS:
-                        modifiers.append(MODIFIERS[part])
-                    elif part in SPECIAL_KEYS:
-                        key = SPECIAL_KEYS[part]
-                    else:
-                        # Try as single character
-                        if len(part) == 1:
-                            key = getattr(Keycode, part, None)
-                
-                # Send modifier combination
-                if key and modifiers:
-                    kbd.send(*modifiers, key)
-                elif key:
-                    kbd.send(key)
-                else:
-                    # Invalid sequence, type it literally
-                    layout.write(macro_string[i:close_idx+1])
+            # Resolve each distinct {...} token once; repeats reuse the op
+            token = macro_string[i:close_idx+1]
+            op = token_ops.get(token)
+            if op is None:
+                op = compile_key_seq(token)
+                token_ops[token] = op
             
-            # Single special key
-            elif key_seq in SPECIAL_KEYS:
-                kbd.send(SPECIAL_KEYS[key_seq])
+            if op[0] == OP_TEXT:
+                # Unknown token, typed literally as part of the text run
+                text.append(op[1])
             else:
-                # Unknown key, type literally
-                layout.write(macro_string[i:close_idx+1])
+                # Flush pending text before the key press
+                if text:
+                    program.append((OP_TEXT, ''.join(text)))
+                    text = []
+                program.append(op)
             
             i = close_idx + 1
         else:
-            # Regular character, type it
-            layout.write(macro_string[i])
+            # Regular character, add to the text run
+            text.append(macro_string[i])
             i += 1
+    
+    if text:
+        program.append((OP_TEXT, ''.join(text)))
+    return program
+
+
+def type_macro(program):
+    """Type a macro program produced by compile_macro().
+    
+    Args:
+        program: List of opcode tuples
+    """
+    # Bound once so the loop uses fast locals, not global + attribute lookups
+    write = layout.write
+    send = kbd.send
+    for op, arg in program:
+        if op == OP_TEXT:
+            write(arg)
+        else:
+            send(*arg)
 
 
-def color_flash(color):
-    """Visual feedback for typing macro: color ramp up to 80%, then down.
+def encode_reports(program):
+    """Encode a macro program into the raw HID reports it would send.
     
-    Total duration: ~1 second (0.5s up, 0.5s down)
+    Each key press becomes an 8-byte keyboard report (modifier bits,
+    reserved byte, up to six keycodes) followed by an all-keys-up
+    report, matching what kbd.send() builds at runtime (a shifted
+    character is one shift+key report).
     
     Args:
-        color: Tuple (G, R, B) in GRB order for WS2812
+        program: List of opcode tuples from compile_macro()
+    
+    Returns:
+        Tuple of 8-byte reports, or None if the text contains a
+        character the US layout cannot type
     """
-    steps = 20
-    max_bright = 0.8  # 80% brightness
-    
-    # Ramp up
-    for i in range(steps):
-        brightness = (i / steps) * max_bright
-        pixel.fill((int(color[0] * brightness),
-                    int(color[1] * brightness),
-                    int(color[2] * brightness)))
-        pixel.show()
-        time.sleep(0.025)
-    
-    # Ramp down
-    for i in range(steps, -1, -1):
-        brightness = (i / steps) * max_bright
-        pixel.fill((int(color[0] * brightness),
-                    int(color[1] * brightness),
-                    int(color[2] * brightness)))
-        pixel.show()
-        time.sleep(0.025)
+    release = bytes(8)
+    reports = []
+    for op, arg in program:
+        if op == OP_TEXT:
+            try:
+                chords = [layout.keycodes(char) for char in arg]
+            except ValueError:
+                return None
+        else:
+            chords = (arg,)
+        for keycodes in chords:
+            report = bytearray(8)
+            slot = 2
+            for keycode in keycodes:
+                modifier = Keycode.modifier_bit(keycode)
+                if modifier:
+                    report[0] |= modifier
+                elif slot < 8:
+                    report[slot] = keycode
+                    slot += 1
+            reports.append(bytes(report))
+            reports.append(release)
+    return tuple(reports)
+
+
+def send_reports(reports):
+    """Send reports from encode_reports() straight to the HID device.
+    
+    Args:
+        reports: Tuple of 8-byte keyboard reports
+    """
+    send_report = kbd._keyboard_device.send_report
+    for report in reports:
+        send_report(report)
+
+
+# --- Compile Macros (once, at startup) ---
+MACRO_PROGRAM = compile_macro(MACRO_STRING)
+KEEPALIVE_PROGRAM = compile_macro(KEEPALIVE_STRING)
+# Keep-alive fires forever, so start_hid() also pre-encodes it to raw
+# reports (None falls back to type_macro())
+keepalive_reports = None
+
+
+def start_hid():
+    """Create the HID keyboard and layout, then pre-encode the keep-alive.
     
-    pixel.fill((0, 0, 0))
-    pixel.show()
+    Called the first time a macro or keep-alive is needed; encoding
+    needs the layout's character table, so it happens here too.
+    """
+    global kbd, layout, keepalive_reports
+    kbd = Keyboard(usb_hid.devices)
+    layout = KeyboardLayoutUS(kbd)
+    keepalive_reports = encode_reports(KEEPALIVE_PROGRAM)
 
 
-def color_pulse(color):
-    """Visual feedback for exiting keep-alive: two quick flashes.
+def start_color_flash(now):
+    """Start macro feedback: color ramp up to 80%, then down (non-blocking).
+    
+    Runs FLASH_STEPS frames up and FLASH_STEPS + 1 down, FLASH_FRAME_MS
+    apart: about 0.45s up and 0.48s down.
     
     Args:
-        color: Tuple (G, R, B) in GRB order for WS2812
+        now: Current supervisor.ticks_ms() value
     """
-    for _ in range(2):
-        pixel.fill(color)
-        pixel.show()
-        time.sleep(0.15)
-        pixel.fill((0, 0, 0))
-        pixel.show()
-        time.sleep(0.15)
+    global flash_mode, flash_step, flash_next_tick
+    flash_mode = FLASH_RAMP_UP
+    flash_step = 0
+    flash_next_tick = now
+
+
+def start_color_pulse(now):
+    """Start keep-alive exit feedback: two quick flashes (non-blocking).
+    
+    Args:
+        now: Current supervisor.ticks_ms() value
+    """
+    global flash_mode, flash_step, flash_next_tick
+    flash_mode = FLASH_PULSE
+    flash_step = 0
+    flash_next_tick = now
+
 
+def stop_flash():
+    """Cancel any running macro flash or exit pulse."""
+    global flash_mode
+    flash_mode = FLASH_IDLE
 
-def update_breathe(color):
+
+def update_flash(now):
+    """Advance the macro flash or exit pulse by one frame when due.
+    
+    Called every loop iteration while flash_mode is not FLASH_IDLE.
+    Always leaves the LED off when the animation finishes.
+    
+    Args:
+        now: Current supervisor.ticks_ms() value
+    """
+    global flash_mode, flash_step, flash_next_tick
+    
+    if ticks_diff(now, flash_next_tick) < 0:
+        return
+    
+    if flash_mode == FLASH_RAMP_UP:
+        set_pixel(FLASH_TABLE[flash_step])
+        flash_step += 1
+        if flash_step == FLASH_STEPS:
+            flash_mode = FLASH_RAMP_DOWN
+        flash_next_tick = ticks_add(flash_next_tick, FLASH_FRAME_MS)
+    elif flash_mode == FLASH_RAMP_DOWN:
+        set_pixel(FLASH_TABLE[flash_step])
+        if flash_step == 0:
+            flash_mode = FLASH_IDLE
+        flash_step -= 1
+        flash_next_tick = ticks_add(flash_next_tick, FLASH_FRAME_MS)
+    else:
+        # Pulse: even steps on, odd steps off
+        set_pixel(CANCEL_COLOR if flash_step % 2 == 0 else LED_OFF)
+        flash_step += 1
+        if flash_step == PULSE_COUNT * 2:
+            flash_mode = FLASH_IDLE
+        flash_next_tick = ticks_add(flash_next_tick, PULSE_FRAME_MS)
+
+
+def start_breathe(now):
+    """Start the keep-alive breathing animation from dark (non-blocking).
+    
+    Args:
+        now: Current supervisor.ticks_ms() value
+    """
+    global breathe_phase, breathe_next_tick
+    breathe_phase = 0
+    breathe_next_tick = now
+
+
+def update_breathe(now):
     """Update breathing LED for keep-alive mode (non-blocking).
     
-    Called every loop iteration when keep-alive is active.
-    Smoothly breathes from 0 to 50% brightness and back.
+    Called every loop iteration when keep-alive is active; advances at
+    most one frame per BREATHE_FRAME_MS. Smoothly breathes from 0 to 50%
+    brightness and back, using colors precomputed in BREATHE_TABLE
+    (set_pixel() skips frames whose color did not change).
     
     Args:
-        color: Tuple (G, R, B) in GRB order for WS2812
+        now: Current supervisor.ticks_ms() value
     """
-    global breathe_brightness, breathe_direction
+    global breathe_phase, breathe_next_tick
     
-    # Update brightness
-    breathe_brightness += breathe_direction * 2
+    if ticks_diff(now, breathe_next_tick) < 0:
+        return
+    breathe_next_tick = ticks_add(now, BREATHE_FRAME_MS)
     
-    # Reverse direction at limits (0-127 = 0-50% brightness)
-    if breathe_brightness >= 127:
-        breathe_brightness = 127
-        breathe_direction = -1
-    elif breathe_brightness <= 0:
-        breathe_brightness = 0
-        breathe_direction = 1
+    # Advance phase and fold it into a triangle wave (0-124 = 0-50% brightness)
+    breathe_phase = (breathe_phase + 4) % 252
+    brightness = 126 - abs(breathe_phase - 126)
     
-    # Apply color with brightness
-    brightness_factor = breathe_brightness / 255
-    pixel.fill((int(color[0] * brightness_factor),
-                int(color[1] * brightness_factor),
-                int(color[2] * brightness_factor)))
-    pixel.show()
+    set_pixel(BREATHE_TABLE[brightness >> 2])
 
 
 # --- Main Program ---
 print("Macro Keyboard Ready!")
 print("- Double-press: Type macro")
 print("- Long-press: Activate keep-alive mode")
+if DEBUG:
+    gc.collect()
+    print(f"Free memory: {gc.mem_free()} bytes")
 
-while True:
-    current_time = time.monotonic()
-    button_reading = read_button()  # True=released, False=pressed
+def main():
+    """Main loop: handle button events and drive macros, keep-alive and LED.
+    
+    Runs forever. Loop state and frequently used callables are kept in
+    locals, which CircuitPython resolves faster than module globals.
+    """
+    # Hot-path callables and settings bound to locals
+    ticks_ms = supervisor.ticks_ms
+    sleep = time.sleep
+    get_event = keys.events.get_into
+    event = keypad.Event()  # Reused for every button event, no allocation
+    long_press_ms = LONG_PRESS_MS
+    double_press_gap_ms = DOUBLE_PRESS_GAP_MS
+    delay_ring = KEEP_ALIVE_DELAY_RING
+    inverted = BUTTON_INVERTED  # Capacitive: keypad's "pressed" means released
+    
+    # --- Button State Tracking ---
+    button_pressed = False  # Button starts released
+    release_time = None  # Time of a release not yet past RELEASE_DEBOUNCE_MS
+    press_start_time = None  # Time when button was pressed (None = not timing)
+    click_count = 0  # Number of clicks for double-press detection
+    last_click_time = 0  # Time of last click
     
-    # Update breathing LED animation if in keep-alive mode
-    if keep_alive_active:
-        update_breathe(KEEPALIVE_COLOR)
+    # --- Keep-Alive Mode State ---
+    keep_alive_active = False  # Is keep-alive mode active?
+    last_keep_alive_time = 0  # Last time we sent a keystroke
+    next_keep_alive_delay = 0  # Randomized delay for next keystroke
+    delay_index = 0  # Position in KEEP_ALIVE_DELAY_RING
+    last_activity_time = ticks_ms()  # Time of last button edge, for poll rate
+    idle = False  # Latched once no edge arrived for POLL_IDLE_AFTER_MS
     
-    # Detect button state changes
-    if button_reading != last_button_state:
-        last_button_state = button_reading
+    while True:
+        current_time = ticks_ms()
+        
+        # Update breathing LED animation if in keep-alive mode
+        if keep_alive_active:
+            update_breathe(current_time)
+        
+        # Advance macro flash / exit pulse animation (non-blocking)
+        if flash_mode != FLASH_IDLE:
+            update_flash(current_time)
         
-        # Button just pressed (active-low: True→False)
-        if not button_reading:
-            print("Button pressed")
-            press_start_time = current_time
+        # Handle button edges queued by keypad (event timestamps are
+        # ticks_ms() values taken at the edge). Presses act immediately;
+        # releases wait RELEASE_DEBOUNCE_MS so contact bounce is ignored.
+        while get_event(event):
+            last_activity_time = event.timestamp
+            idle = False
+            
+            # Button just pressed
+            if event.pressed != inverted:
+                bounced = (release_time is not None and
+                           ticks_diff(event.timestamp, release_time) < RELEASE_DEBOUNCE_MS)
+                release_time = None
+                if bounced:
+                    continue  # Contact bounce, the button never let go
+                
+                button_pressed = True
+                if DEBUG:
+                    print("Button pressed")
+                press_start_time = event.timestamp
+                
+                # Any press during keep-alive exits the mode
+                if keep_alive_active:
+                    if DEBUG:
+                        print("Exiting keep-alive mode")
+                    keep_alive_active = False
+                    start_color_pulse(current_time)
+                else:
+                    # Count clicks for double-press detection
+                    click_count += 1
+                    last_click_time = event.timestamp
             
-            # Any press during keep-alive exits the mode
-            if keep_alive_active:
-                print("Exiting keep-alive mode")
-                keep_alive_active = False
-                color_pulse(CANCEL_COLOR)
-                pixel.fill((0, 0, 0))
-                pixel.show()
+            # Button just released (committed below once it stays up)
             else:
-                # Count clicks for double-press detection
-                click_count += 1
-                last_click_time = current_time
+                release_time = event.timestamp
         
-        # Button just released (active-low: False→True)
+        # Commit a release once the button has stayed up long enough
+        if (release_time is not None and
+                ticks_diff(current_time, release_time) >= RELEASE_DEBOUNCE_MS):
+            button_pressed = False
+            if DEBUG:
+                if press_start_time is not None:
+                    print(f"Button released ({ticks_diff(release_time, press_start_time)}ms)")
+                else:
+                    print("Button released")
+            release_time = None
+        
+        # Long press detection: check while button is held
+        if (button_pressed and release_time is None and not keep_alive_active and
+                press_start_time is not None and
+                ticks_diff(current_time, press_start_time) >= long_press_ms):
+            if DEBUG:
+                print("Long press - activating keep-alive")
+            keep_alive_active = True
+            if kbd is None:
+                start_hid()  # Ready before the first keep-alive keystroke
+            stop_flash()  # Breathing takes over the LED
+            start_breathe(current_time)
+            last_keep_alive_time = current_time
+            # Start the delay ring at an offset taken from the press timing
+            delay_index = current_time & KEEP_ALIVE_RING_MASK
+            next_keep_alive_delay = delay_ring[delay_index]
+            click_count = 0  # Clear pending clicks
+            press_start_time = None  # Prevent re-triggering
+        
+        # Double-press detection: check if timeout expired
+        if (click_count > 0 and
+                ticks_diff(current_time, last_click_time) > double_press_gap_ms):
+            if click_count == 2 and not keep_alive_active:
+                if DEBUG:
+                    print("Double press - typing macro")
+                if kbd is None:
+                    start_hid()
+                type_macro(MACRO_PROGRAM)  # Type precompiled macro
+                # Then show animation, timed from when typing finished
+                start_color_flash(ticks_ms())
+            click_count = 0  # Reset for next detection
+        
+        # Keep-alive: send keystrokes at random intervals
+        if (keep_alive_active and
+                ticks_diff(current_time, last_keep_alive_time) > next_keep_alive_delay):
+            # Type the keep-alive sequence
+            if keepalive_reports is None:
+                type_macro(KEEPALIVE_PROGRAM)
+            else:
+                send_reports(keepalive_reports)
+            last_keep_alive_time = current_time
+            # Take the next delay from the ring
+            delay_index = (delay_index + 1) & KEEP_ALIVE_RING_MASK
+            next_keep_alive_delay = delay_ring[delay_index]
+        
+        # Poll at 100Hz while anything is happening, back off when idle.
+        # Idle is latched, so last_activity_time is never compared once it
+        # is old enough for ticks_diff() to wrap around.
+        if not idle and ticks_diff(current_time, last_activity_time) >= POLL_IDLE_AFTER_MS:
+            idle = True
+        if (idle and not keep_alive_active and flash_mode == FLASH_IDLE and
+                click_count == 0 and not button_pressed):
+            sleep(POLL_IDLE)
         else:
-            print(f"Button released ({current_time - press_start_time:.2f}s)")
-    
-    # Long press detection: check while button is held
-    if (not button_reading and not keep_alive_active and
-            press_start_time > 0 and
-            (current_time - press_start_time) >= LONG_PRESS_DURATION):
-        print("Long press - activating keep-alive")
-        keep_alive_active = True
-        last_keep_alive_time = current_time
-        # Set initial random delay
-        next_keep_alive_delay = random.uniform(KEEP_ALIVE_MIN,
-                                               KEEP_ALIVE_MAX)
-        click_count = 0  # Clear pending clicks
-        press_start_time = 0  # Prevent re-triggering
-    
-    # Double-press detection: check if timeout expired
-    if (click_count > 0 and
-            (current_time - last_click_time) > DOUBLE_PRESS_GAP):
-        if click_count == 2 and not keep_alive_active:
-            print("Double press - typing macro")
-            parse_and_type_macro(MACRO_STRING)  # Parse and type
-            color_flash(MACRO_COLOR)  # Then show animation
-        click_count = 0  # Reset for next detection
-    
-    # Keep-alive: send keystrokes at random intervals
-    if (keep_alive_active and
-            (current_time - last_keep_alive_time) > next_keep_alive_delay):
-        # Type the keep-alive sequence
-        parse_and_type_macro(KEEPALIVE_STRING)
-        last_keep_alive_time = current_time
-        # Generate next random delay
-        next_keep_alive_delay = random.uniform(KEEP_ALIVE_MIN,
-                                               KEEP_ALIVE_MAX)
-    
-    time.sleep(0.01)  # Poll at 100Hz
+            sleep(POLL_FAST)
+
+
+main()
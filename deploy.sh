@@ -20,6 +20,27 @@ for file in "${FILES[@]}"; do
     cp "$file" "$MOUNT_PATH/"
 done
 
+# Shared modules are precompiled to .mpy bytecode when mpy-cross is available
+# (must match the device's CircuitPython major version). This skips parsing
+# them at boot. CircuitPython prefers .py over .mpy, so remove the other form.
+MPY_MODULES=("_usb_presets.py" "_keys.py" "_config.py")
+for module in "${MPY_MODULES[@]}"; do
+    if [ ! -f "$module" ]; then
+        echo "⚠️  Warning: $module not found, skipping"
+        continue
+    fi
+    compiled="${module%.py}.mpy"
+    if command -v mpy-cross >/dev/null 2>&1 && mpy-cross "$module" -o "$compiled"; then
+        echo "   Copying $compiled (precompiled)..."
+        cp "$compiled" "$MOUNT_PATH/"
+        rm -f "$MOUNT_PATH/$module"
+    else
+        echo "   Copying $module (mpy-cross not found, using source)..."
+        cp "$module" "$MOUNT_PATH/"
+        rm -f "$MOUNT_PATH/$compiled"
+    fi
+done
+
 sync
 echo "✅ Deployment complete! Device will auto-reload."
 echo "💡 Note: After reboot, device will be in stealth mode (no drive/serial)."